@@ -156,6 +156,7 @@ class IPMIUpdater(object):
         status = status[0]
         has_cert = int(status.get('CERT_EXIST'))
         has_cert = bool(has_cert)
+        valid_from = valid_until = None
         if has_cert:
             valid_from = status.get('VALID_FROM')
             valid_until = status.get('VALID_UNTIL')
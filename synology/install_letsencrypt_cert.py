@@ -0,0 +1,271 @@
+'''Let's Encrypt certificate installer for Synology DSM
+
+This script is the Python replacement for install_letsencrypt_cert_from_pfsense.sh.
+It installs the specified Let's Encrypt certificate issued by your pfSense from a local share
+into your Synology DSM.
+
+The new certificate is hashed once and compared with every *.pem file of every DSM certificate folder.
+Only files that differ are rewritten (atomically) and only the services using the changed folders
+are restarted, so runs where the certificate did not change do not restart anything.
+The services to restart are recorded at PENDING_RESTART_FILE_NAME before any file is replaced,
+so restarts that failed are retried on the next run.
+'''
+
+import argparse
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+
+DEFAULT_CERT_ROOT_DIR = '/usr/syno/etc/certificate'
+ARCHIVE_DIR_NAME = '_archive'
+# Services still to be restarted, one per line, kept under the certificate root folder
+PENDING_RESTART_FILE_NAME = '.pending_restart'
+
+# Services to restart when a certificate folder changes, keyed by its top-level folder under DEFAULT_CERT_ROOT_DIR
+SERVICES_BY_CERT_DIR = {
+    ARCHIVE_DIR_NAME: ['nginx'],
+    'system': ['nginx'],
+    'AppPortal': ['nginx'],
+    'ReverseProxy': ['nginx'],
+}
+# Services to restart for certificate folders not listed at SERVICES_BY_CERT_DIR (e.g. smbftpd, the FTPS certificate,
+# whose service name could not be confirmed for every DSM version)
+DEFAULT_SERVICES = ['nginx']
+
+# Service names as known by synoservice (DSM 6) and synosystemctl (DSM 7+)
+SERVICE_NAMES = {
+    'nginx': ('nginx', 'nginx'),
+}
+
+
+def dsm_major_version(version_file='/etc/VERSION'):
+    """Read the Synology DSM major version
+
+    Args:
+        version_file (str): Path to the DSM version file
+
+    Returns:
+        int: DSM major version (e.g. 7)
+    """
+    with open(version_file) as f:
+        match = re.search(r'^majorversion="?(\d+)"?', f.read(), re.MULTILINE)
+    if not match:
+        raise RuntimeError(f'Could not find the DSM major version at {version_file}')
+    return int(match.group(1))
+
+
+def find_cert_dirs(cert_root):
+    """Find every folder containing a DSM certificate
+
+    Args:
+        cert_root (str): DSM certificate root folder (e.g. /usr/syno/etc/certificate)
+
+    Returns:
+        list[str]: Folders with a cert.pem outside of the archive plus the default archived certificate folder
+    """
+    cert_dirs = []
+    for dirpath, dirnames, filenames in os.walk(cert_root):
+        if dirpath == cert_root and ARCHIVE_DIR_NAME in dirnames:
+            dirnames.remove(ARCHIVE_DIR_NAME)
+        dirnames.sort()
+        if 'cert.pem' in filenames:
+            cert_dirs.append(dirpath)
+
+    archive_dir = os.path.join(cert_root, ARCHIVE_DIR_NAME)
+    default_file = os.path.join(archive_dir, 'DEFAULT')
+    if os.path.isfile(default_file):
+        with open(default_file) as f:
+            cert_dirs.append(os.path.join(archive_dir, f.read().strip()))
+    return cert_dirs
+
+
+def replace_file(path, content):
+    """Atomically replace the content of a file, keeping its permissions and ownership
+
+    Args:
+        path (str): File to be replaced
+        content (bytes): New content
+    """
+    stat = os.stat(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, stat.st_mode & 0o7777)
+        if os.geteuid() == 0:
+            os.chown(tmp_path, stat.st_uid, stat.st_gid)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_pending_restart(cert_root=DEFAULT_CERT_ROOT_DIR):
+    """Read the services still to be restarted
+
+    Args:
+        cert_root (str): DSM certificate root folder
+
+    Returns:
+        list[str]: Services to restart, empty when there are none
+    """
+    try:
+        with open(os.path.join(cert_root, PENDING_RESTART_FILE_NAME)) as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def add_pending_restart(services, cert_root=DEFAULT_CERT_ROOT_DIR):
+    """Record services to be restarted, keeping the ones already recorded
+
+    Args:
+        services (list[str]): Services to restart
+        cert_root (str): DSM certificate root folder
+    """
+    pending = read_pending_restart(cert_root)
+    pending.extend(service for service in services if service not in pending)
+    path = os.path.join(cert_root, PENDING_RESTART_FILE_NAME)
+    with open(path, 'w') as f:
+        f.write(''.join(f'{service}\n' for service in pending))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def install_certificate(new_cert, cert_root=DEFAULT_CERT_ROOT_DIR, dry_run=False, debug=False):
+    """Copy the new certificate over every *.pem file of the DSM certificate folders that differs from it
+
+    The services using the changed folders are recorded as pending restart before any file is replaced.
+
+    Args:
+        new_cert (str): Path to the new certificate, with private key and chain (e.g. SynologySSL.all.pem)
+        cert_root (str): DSM certificate root folder
+        dry_run (bool): Only report which files differ, without replacing them
+        debug (bool): Enable debug logs
+
+    Returns:
+        list[str]: Certificate folders with at least one replaced file
+    """
+    with open(new_cert, 'rb') as f:
+        content = f.read()
+    new_digest = hashlib.sha256(content).digest()
+
+    changed_files = {}
+    for cert_dir in find_cert_dirs(cert_root):
+        for entry in os.scandir(cert_dir):
+            if not entry.name.endswith('.pem') or not entry.is_file():
+                continue
+            if entry.stat().st_size == len(content):
+                with open(entry.path, 'rb') as f:
+                    if hashlib.sha256(f.read()).digest() == new_digest:
+                        continue
+            changed_files.setdefault(cert_dir, []).append(entry.path)
+        if debug and cert_dir not in changed_files:
+            print(f'Certificates from {cert_dir} are already current')
+
+    changed_dirs = list(changed_files)
+    if changed_dirs and not dry_run:
+        add_pending_restart(services_for_dirs(changed_dirs, cert_root), cert_root)
+    for paths in changed_files.values():
+        for path in paths:
+            if dry_run:
+                print(f'Would replace {path} with {new_cert}')
+            else:
+                print(f'Replacing {path} with {new_cert}')
+                replace_file(path, content)
+    return changed_dirs
+
+
+def services_for_dirs(cert_dirs, cert_root=DEFAULT_CERT_ROOT_DIR):
+    """Map changed certificate folders to the services using them
+
+    Args:
+        cert_dirs (list[str]): Changed certificate folders
+        cert_root (str): DSM certificate root folder
+
+    Returns:
+        list[str]: Services to restart, in the order they were first needed
+    """
+    services = []
+    for cert_dir in cert_dirs:
+        top_dir = os.path.relpath(cert_dir, cert_root).split(os.sep)[0]
+        for service in SERVICES_BY_CERT_DIR.get(top_dir, DEFAULT_SERVICES):
+            if service not in services:
+                services.append(service)
+    return services
+
+
+def restart_services(services, major_version):
+    """Restart DSM services
+
+    Every service is attempted even when restarting a previous one failed.
+
+    Args:
+        services (list[str]): Services to restart, as keys of SERVICE_NAMES
+        major_version (int): DSM major version
+    """
+    failed = []
+    for service in services:
+        dsm6_name, dsm7_name = SERVICE_NAMES[service]
+        if major_version == 6:
+            command = ['synoservice', '--restart', dsm6_name]
+        else:
+            command = ['synosystemctl', 'restart', dsm7_name]
+        print(f'Restarting {service}')
+        if subprocess.run(command).returncode != 0:
+            failed.append(service)
+    if failed:
+        raise RuntimeError(f'Failed to restart services {failed}')
+
+
+def restart_pending_services(cert_root=DEFAULT_CERT_ROOT_DIR, major_version=None):
+    """Restart the services pending restart, including the ones that failed on previous runs
+
+    They are only cleared from the pending list once all of them were restarted.
+
+    Args:
+        cert_root (str): DSM certificate root folder
+        major_version (int): DSM major version. Read from the system when not specified
+
+    Returns:
+        list[str]: Restarted services
+    """
+    services = read_pending_restart(cert_root)
+    if services:
+        restart_services(services, major_version if major_version is not None else dsm_major_version())
+        os.remove(os.path.join(cert_root, PENDING_RESTART_FILE_NAME))
+    return services
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Install a Let's Encrypt certificate issued by pfSense into Synology DSM")
+    parser.add_argument('--letsencrypt-share', required=True,
+                        help="Full share path to download the Let's Encrypt certificates into (e.g. /volume1/LetsEncrypt)")
+    parser.add_argument('--certificate-name', required=True,
+                        help="Let's Encrypt certificate name as displayed on pfSense UI (e.g. SynologySSL)")
+    parser.add_argument('--cert-root', default=DEFAULT_CERT_ROOT_DIR,
+                        help='DSM certificate root folder')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report which files and services would change')
+    parser.add_argument('--debug', help='Enable debug logs', action='store_true')
+    args = parser.parse_args()
+
+    new_cert = os.path.join(args.letsencrypt_share, f'{args.certificate_name}.all.pem')
+    changed_dirs = install_certificate(new_cert, args.cert_root, dry_run=args.dry_run, debug=args.debug)
+    if args.dry_run:
+        services = services_for_dirs(changed_dirs, args.cert_root)
+        for service in read_pending_restart(args.cert_root):
+            if service not in services:
+                services.append(service)
+        print(f'Services that would be restarted: {services}')
+    elif not restart_pending_services(args.cert_root):
+        print('Certificate is already current. No services restarted')
+
+
+if __name__ == '__main__':
+    main()
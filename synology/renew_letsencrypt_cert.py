@@ -0,0 +1,259 @@
+'''Let's Encrypt certificate renewal orchestrator for Synology DSM and Supermicro IPMI
+
+This script replaces the copy_letsencrypt_cert_from_pfsense.sh, install_letsencrypt_cert_from_pfsense.sh
+and supermicro-ipmi-updater.sh chain. The renewal is modeled as a dependency graph of steps:
+the certificate is fetched from pfSense once and then installed on the Synology DSM and on every
+IPMI host in parallel.
+
+The IPMI updater is loaded from this repository checkout instead of being downloaded on every run,
+and targets whose certificate is already current are skipped.
+'''
+
+import argparse
+import concurrent.futures
+import importlib.util
+import os
+import ssl
+import subprocess
+import sys
+
+import install_letsencrypt_cert
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+IPMI_UPDATER_PATH = os.path.join(
+    SCRIPT_DIR, os.pardir, 'supermicro', 'ipmi-updater', 'ipmi-updater.py')
+
+UPDATED = 'updated'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+class Step(object):
+    '''A named unit of work that runs after all the steps it depends on succeeded
+
+    The action is a callable without arguments returning either UPDATED or SKIPPED.
+    Raising any exception marks the step as FAILED and blocks every step depending on it.
+    '''
+
+    def __init__(self, name, action, depends_on=()):
+        self.name = name
+        self.action = action
+        self.depends_on = tuple(depends_on)
+
+
+def run_steps(steps, max_workers=None):
+    """Run steps in dependency order, running independent steps in parallel
+
+    Args:
+        steps (list[Step]): Steps to run. Dependencies must refer to names of other steps in this list
+        max_workers (int): Maximum number of steps running at the same time
+
+    Returns:
+        dict: Maps each step name to a (status, message) tuple
+    """
+    pending = {}
+    for step in steps:
+        if step.name in pending:
+            raise ValueError(f'Step "{step.name}" is duplicated')
+        pending[step.name] = step
+    for step in steps:
+        unknown = [dep for dep in step.depends_on if dep not in pending]
+        if unknown:
+            raise ValueError(f'Step "{step.name}" depends on unknown steps {unknown}')
+
+    results = {}
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, step in list(pending.items()):
+                if not all(dep in results for dep in step.depends_on):
+                    continue
+                del pending[name]
+                failed = [dep for dep in step.depends_on if results[dep][0] in (FAILED, BLOCKED)]
+                if failed:
+                    results[name] = (BLOCKED, f'depends on {failed}')
+                else:
+                    running[executor.submit(step.action)] = name
+
+            if not running:
+                if pending:
+                    raise ValueError(f'Steps {sorted(pending)} have circular dependencies')
+                break
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = (future.result(), '')
+                except Exception as e:
+                    results[name] = (FAILED, str(e))
+    return results
+
+
+def cert_validity(cert_file):
+    """Read the validity period of the first certificate of a PEM file
+
+    Args:
+        cert_file (str): Path to the PEM certificate
+
+    Returns:
+        tuple: (not before, not after) as seconds since the epoch
+    """
+    output = subprocess.run(['openssl', 'x509', '-noout', '-startdate', '-enddate', '-in', cert_file],
+                            check=True, capture_output=True, text=True).stdout
+    # e.g. notBefore=Feb 13 21:58:05 2021 GMT\nnotAfter=May 14 21:58:04 2021 GMT
+    dates = dict(line.split('=', 1) for line in output.strip().splitlines())
+    return ssl.cert_time_to_seconds(dates['notBefore']), ssl.cert_time_to_seconds(dates['notAfter'])
+
+
+def ipmi_cert_validity(cert_info):
+    """Parse the validity period reported by the IPMI
+
+    Args:
+        cert_info (dict): Certificate information as returned by IPMIUpdater.get_ipmi_cert_info
+
+    Returns:
+        tuple: (valid from, valid until) as seconds since the epoch or None when they cannot be parsed
+    """
+    try:
+        # IPMI reports dates like 'May 14 21:58:04 2021', without the time zone
+        return (ssl.cert_time_to_seconds(cert_info['valid_from'] + ' GMT'),
+                ssl.cert_time_to_seconds(cert_info['valid_until'] + ' GMT'))
+    except (TypeError, ValueError):
+        return None
+
+
+def load_ipmi_updater():
+    '''Load supermicro/ipmi-updater/ipmi-updater.py from this repository checkout'''
+    spec = importlib.util.spec_from_file_location('ipmi_updater', IPMI_UPDATER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.requests.packages.urllib3.disable_warnings(
+        module.requests.packages.urllib3.exceptions.InsecureRequestWarning)
+    return module
+
+
+def fetch_from_pfsense(args):
+    '''Copy the certificate files issued by pfSense's ACME package into the Let's Encrypt share'''
+    if args.debug:
+        print(f'Fetching {args.certificate_name} from {args.pfsense_username}@{args.pfsense_hostname}')
+    subprocess.run(['scp', '-q', '-P', str(args.pfsense_port),
+                    f'{args.pfsense_username}@{args.pfsense_hostname}:/conf/acme/{args.certificate_name}*',
+                    args.letsencrypt_share + '/'],
+                   check=True)
+    return UPDATED
+
+
+def install_on_dsm(args, new_cert):
+    '''Install the certificate on the Synology DSM, restarting only the services whose certificates changed'''
+    changed_dirs = install_letsencrypt_cert.install_certificate(new_cert, debug=args.debug)
+    # Also retries the restarts that failed on previous runs
+    restarted = install_letsencrypt_cert.restart_pending_services()
+    if not changed_dirs and not restarted:
+        return SKIPPED
+    return UPDATED
+
+
+def install_on_ipmi(args, ipmi_updater, ipmi_url, cert_file, key_file):
+    '''Upload the certificate to a Supermicro IPMI unless it already has it
+
+    The IPMI only reports the validity period of its certificate, so it is considered to have the new
+    certificate when both dates match exactly.
+    '''
+    updater = ipmi_updater.IPMIX10Updater(ipmi_updater.requests.session(), ipmi_url)
+    if not updater.login(args.ipmi_username, args.ipmi_password):
+        raise RuntimeError(f'Login failed on {ipmi_url}')
+
+    cert_info = updater.get_ipmi_cert_info()
+    if not cert_info:
+        raise RuntimeError(f'Failed to extract certificate information from {ipmi_url}')
+    if cert_info['has_cert']:
+        if args.debug:
+            print(f'{ipmi_url} has a certificate valid until {cert_info["valid_until"]}')
+        if ipmi_cert_validity(cert_info) == cert_validity(cert_file):
+            return SKIPPED
+
+    if not updater.upload_cert(key_file, cert_file):
+        raise RuntimeError(f'Failed to upload X.509 files to {ipmi_url}')
+    if not updater.get_ipmi_cert_valid():
+        raise RuntimeError(f'New certificate failed validation on {ipmi_url}')
+    if not args.no_reboot and not updater.reboot_ipmi():
+        raise RuntimeError(f'Rebooting {ipmi_url} failed! Go reboot it manually?')
+    return UPDATED
+
+
+def build_steps(args):
+    """Build the renewal dependency graph
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+
+    Returns:
+        list[Step]: Steps to be run by run_steps
+    """
+    prefix = os.path.join(args.letsencrypt_share, args.certificate_name)
+    steps = []
+    fan_out_deps = ()
+    if not args.no_fetch:
+        steps.append(Step('pfsense', lambda: fetch_from_pfsense(args)))
+        fan_out_deps = ('pfsense',)
+
+    if not args.no_dsm:
+        steps.append(Step('dsm', lambda: install_on_dsm(args, prefix + '.all.pem'), fan_out_deps))
+
+    if args.ipmi_url:
+        ipmi_updater = load_ipmi_updater()
+        for ipmi_url in args.ipmi_url:
+            ipmi_url = ipmi_url.rstrip('/')
+            steps.append(Step(f'ipmi {ipmi_url}',
+                              lambda url=ipmi_url: install_on_ipmi(
+                                  args, ipmi_updater, url, prefix + '.crt', prefix + '.key'),
+                              fan_out_deps))
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fetch a Let's Encrypt certificate from pfSense and install it on Synology DSM and Supermicro IPMI hosts")
+    parser.add_argument('--letsencrypt-share', required=True,
+                        help="Full share path to download the Let's Encrypt certificates into (e.g. /volume1/LetsEncrypt)")
+    parser.add_argument('--certificate-name', required=True,
+                        help="Let's Encrypt certificate name as displayed on pfSense UI (e.g. SynologySSL)")
+    parser.add_argument('--pfsense-hostname', help='pfSense hostname (e.g. mypfsense.lan.example.com)')
+    parser.add_argument('--pfsense-port', type=int, default=22, help='SSH port for the pfSense')
+    parser.add_argument('--pfsense-username',
+                        help="Username (with proper SSH keys) for the pfSense - cannot be 'admin'")
+    parser.add_argument('--no-fetch', action='store_true',
+                        help='Use the certificate already in --letsencrypt-share instead of fetching it from pfSense')
+    parser.add_argument('--no-dsm', action='store_true',
+                        help='Do not install the certificate on this Synology DSM')
+    parser.add_argument('--ipmi-url', action='append', default=[],
+                        help='Supermicro IPMI 2.0 URL. Can be repeated for multiple hosts')
+    parser.add_argument('--ipmi-username', help='IPMI username with admin access')
+    parser.add_argument('--ipmi-password', help='IPMI user password')
+    parser.add_argument('--no-reboot', action='store_true',
+                        help='Do not reboot the IPMI after upload. The new certificate takes effect after the next reboot')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='Maximum number of targets updated in parallel')
+    parser.add_argument('--debug', help='Enable debug logs', action='store_true')
+    args = parser.parse_args()
+
+    if not args.no_fetch and not (args.pfsense_hostname and args.pfsense_username):
+        parser.error('--pfsense-hostname and --pfsense-username are required unless --no-fetch is set')
+    if args.ipmi_url and not (args.ipmi_username and args.ipmi_password):
+        parser.error('--ipmi-username and --ipmi-password are required with --ipmi-url')
+    ipmi_urls = [ipmi_url.rstrip('/') for ipmi_url in args.ipmi_url]
+    if len(set(ipmi_urls)) != len(ipmi_urls):
+        parser.error('--ipmi-url must not be repeated for the same host')
+
+    results = run_steps(build_steps(args), max_workers=args.max_workers)
+    for name, (status, message) in results.items():
+        print(f'{name}: {status}' + (f' ({message})' if message else ''))
+    if any(status in (FAILED, BLOCKED) for status, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
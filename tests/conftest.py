@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts are not packaged, they import their siblings as top-level modules
+for script_dir in ("synology", "xmltv"):
+    sys.path.insert(0, os.path.join(REPO_DIR, script_dir))
+
+
+@pytest.fixture(scope="session")
+def certificate(tmp_path_factory):
+    """Self-signed certificate and private key, as (cert file, key file)"""
+    tmp_path = tmp_path_factory.mktemp("certificate")
+    cert_file, key_file = str(tmp_path / "cert.crt"), str(tmp_path / "cert.key")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "90", "-subj", "/CN=homelab.test",
+         "-keyout", key_file, "-out", cert_file],
+        check=True, capture_output=True,
+    )
+    return cert_file, key_file
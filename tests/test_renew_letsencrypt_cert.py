@@ -0,0 +1,199 @@
+import argparse
+import os
+import stat
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import renew_letsencrypt_cert as renew
+from renew_letsencrypt_cert import BLOCKED, FAILED, SKIPPED, UPDATED, Step
+
+
+def ipmi_args(**kwargs):
+    defaults = dict(ipmi_username="ADMIN", ipmi_password="secret", no_reboot=False, debug=False)
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+def openssl_dates(cert_file):
+    """Validity period of a certificate formatted as reported by the IPMI (e.g. 'May 14 21:58:04 2021')"""
+    output = subprocess.run(["openssl", "x509", "-noout", "-startdate", "-enddate", "-in", cert_file],
+                            check=True, capture_output=True, text=True).stdout
+    dates = dict(line.split("=", 1) for line in output.strip().splitlines())
+    return dates["notBefore"].replace(" GMT", ""), dates["notAfter"].replace(" GMT", "")
+
+
+class FakeIPMIHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, content_type="text/html"):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply('<script>SmcCsrfInsert ("CSRF_TOKEN", "token");</script>')
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode(errors="replace")
+        state["requests"].append(self.path)
+        if self.path == "/cgi/login.cgi":
+            self.reply("<html>/cgi/url_redirect.cgi?url_name=mainmenu</html>")
+        elif self.path == "/cgi/ipmi.cgi" and "SSL_STATUS.XML" in body:
+            valid_from, valid_until = state["cert"] or ("", "")
+            self.reply(f'<?xml version="1.0"?><IPMI><SSL_INFO><STATUS CERT_EXIST="{int(bool(state["cert"]))}" '
+                       f'VALID_FROM="{valid_from}" VALID_UNTIL="{valid_until}"/></SSL_INFO></IPMI>', "text/xml")
+        elif self.path == "/cgi/ipmi.cgi" and "SSL_VALIDATE.XML" in body:
+            self.reply('<?xml version="1.0"?><IPMI><SSL_INFO VALIDATE="1"/></IPMI>', "text/xml")
+        elif self.path == "/cgi/upload_ssl.cgi":
+            state["cert"] = state["uploaded"]
+            self.reply("<html>CONFPAGE_RESET</html>")
+        elif self.path == "/cgi/BMCReset.cgi":
+            self.reply('<?xml version="1.0"?><IPMI><STATE CODE="OK"/></IPMI>', "text/xml")
+        else:
+            self.send_error(404)
+
+
+@pytest.fixture
+def fake_ipmi(certificate):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeIPMIHandler)
+    server.state = {"cert": None, "uploaded": openssl_dates(certificate[0]), "requests": []}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", server.state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def ipmi_updater():
+    return renew.load_ipmi_updater()
+
+
+def test_run_steps_runs_independent_steps_in_parallel():
+    # The fan-out steps only get past the barrier when all of them run at the same time
+    barrier = threading.Barrier(3)
+
+    def fan_out(status):
+        def action():
+            barrier.wait(timeout=10)
+            return status
+        return action
+
+    results = renew.run_steps([
+        Step("fetch", lambda: UPDATED),
+        Step("dsm", fan_out(SKIPPED), ["fetch"]),
+        Step("ipmi 1", fan_out(UPDATED), ["fetch"]),
+        Step("ipmi 2", fan_out(UPDATED), ["fetch"]),
+    ])
+    assert results == {
+        "fetch": (UPDATED, ""), "dsm": (SKIPPED, ""), "ipmi 1": (UPDATED, ""), "ipmi 2": (UPDATED, ""),
+    }
+
+
+def test_run_steps_blocks_dependents_of_failed_steps():
+    def fail():
+        raise RuntimeError("scp failed")
+
+    ran = []
+    results = renew.run_steps([
+        Step("fetch", fail),
+        Step("dsm", lambda: ran.append("dsm"), ["fetch"]),
+        Step("reload", lambda: ran.append("reload"), ["dsm"]),
+        Step("other", lambda: UPDATED),
+    ])
+    assert ran == []
+    assert results["fetch"] == (FAILED, "scp failed")
+    assert results["dsm"][0] == BLOCKED
+    assert results["reload"][0] == BLOCKED
+    assert results["other"] == (UPDATED, "")
+
+
+@pytest.mark.parametrize("steps, message", [
+    ([Step("a", lambda: UPDATED, ["b"]), Step("b", lambda: UPDATED, ["a"])], "circular"),
+    ([Step("a", lambda: UPDATED, ["missing"])], "unknown"),
+    ([Step("ipmi https://host", lambda: UPDATED), Step("ipmi https://host", lambda: UPDATED)], "duplicated"),
+])
+def test_run_steps_rejects_invalid_graphs(steps, message):
+    with pytest.raises(ValueError, match=message):
+        renew.run_steps(steps)
+
+
+def test_fetch_from_pfsense_uses_scp(tmp_path, monkeypatch):
+    # Local stand-in for scp copying from a fake pfSense /conf/acme folder
+    acme_dir = tmp_path / "pfsense"
+    acme_dir.mkdir()
+    for suffix in (".all.pem", ".crt", ".key"):
+        (acme_dir / f"SynologySSL{suffix}").write_text(suffix)
+    (acme_dir / "Other.crt").write_text("other")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    scp = bin_dir / "scp"
+    scp.write_text(f"""#!{sys.executable}
+import glob, os, shutil, sys
+open({str(tmp_path / "scp_args")!r}, "w").write(" ".join(sys.argv[1:]))
+source, destination = sys.argv[-2:]
+for path in glob.glob(os.path.join({str(acme_dir)!r}, os.path.basename(source.split(":", 1)[1]))):
+    shutil.copy(path, destination)
+""")
+    scp.chmod(scp.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    share = tmp_path / "share"
+    share.mkdir()
+
+    args = argparse.Namespace(certificate_name="SynologySSL", pfsense_username="synouser",
+                              pfsense_hostname="pfsense.lan", pfsense_port=2222,
+                              letsencrypt_share=str(share), debug=False)
+    assert renew.fetch_from_pfsense(args) == UPDATED
+    assert sorted(os.listdir(share)) == ["SynologySSL.all.pem", "SynologySSL.crt", "SynologySSL.key"]
+    assert "-P 2222 synouser@pfsense.lan:/conf/acme/SynologySSL*" in (tmp_path / "scp_args").read_text()
+
+
+def test_install_on_ipmi_uploads_when_ipmi_has_no_certificate(fake_ipmi, ipmi_updater, certificate):
+    url, state = fake_ipmi
+    assert renew.install_on_ipmi(ipmi_args(), ipmi_updater, url, *certificate) == UPDATED
+    assert "/cgi/upload_ssl.cgi" in state["requests"]
+    assert "/cgi/BMCReset.cgi" in state["requests"]
+
+
+def test_install_on_ipmi_replaces_longer_lived_certificate(fake_ipmi, ipmi_updater, certificate):
+    url, state = fake_ipmi
+    # e.g. the factory self-signed certificate, valid for years
+    state["cert"] = ("Jan  1 00:00:00 2020", "Dec 31 23:59:59 2099")
+    assert renew.install_on_ipmi(ipmi_args(no_reboot=True), ipmi_updater, url, *certificate) == UPDATED
+    assert "/cgi/upload_ssl.cgi" in state["requests"]
+    assert "/cgi/BMCReset.cgi" not in state["requests"]
+
+
+def test_install_on_ipmi_skips_when_ipmi_has_the_certificate(fake_ipmi, ipmi_updater, certificate):
+    url, state = fake_ipmi
+    state["cert"] = state["uploaded"]
+    assert renew.install_on_ipmi(ipmi_args(), ipmi_updater, url, *certificate) == SKIPPED
+    assert state["requests"] == ["/cgi/login.cgi", "/cgi/ipmi.cgi"]
+
+
+def test_build_steps_fans_out_after_fetch():
+    args = argparse.Namespace(letsencrypt_share="/share", certificate_name="SynologySSL", no_fetch=False,
+                              no_dsm=False, ipmi_url=["https://ipmi1/", "https://ipmi2"])
+    steps = renew.build_steps(args)
+    assert [(step.name, step.depends_on) for step in steps] == [
+        ("pfsense", ()),
+        ("dsm", ("pfsense",)),
+        ("ipmi https://ipmi1", ("pfsense",)),
+        ("ipmi https://ipmi2", ("pfsense",)),
+    ]
+
+
+def test_build_steps_rejects_same_ipmi_host_twice():
+    args = argparse.Namespace(letsencrypt_share="/share", certificate_name="SynologySSL", no_fetch=True,
+                              no_dsm=True, ipmi_url=["https://ipmi1/", "https://ipmi1"])
+    with pytest.raises(ValueError, match="duplicated"):
+        renew.run_steps(renew.build_steps(args))
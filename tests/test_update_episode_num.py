@@ -0,0 +1,110 @@
+from xml.dom.minidom import parseString
+
+import pytest
+
+import update_episode_num
+from update_episode_num import EpisodeNumRules, date_strategy
+
+
+def programme_element(children, channel="a", start="20240115093000 -0300"):
+    document = parseString(f'<tv><programme start="{start}" channel="{channel}">{children}</programme></tv>')
+    return document, document.getElementsByTagName("programme")[0]
+
+
+@pytest.fixture
+def rules_file(tmp_path):
+    path = tmp_path / "rules.ini"
+    path.write_text(
+        "# comment\n"
+        "\n"
+        "11.* TV Camara*, keep\n"
+        "* Warner*, regex|date, [Tt](?P<season>\\d{1,3})\\s*[Ee]p?\\s*(?P<episode>\\d{1,4})\n"
+        "*Series*, regex\n"
+        "*, date\n"
+    )
+    return str(path)
+
+
+def test_load_rules_dispatches_first_matching_rule(rules_file):
+    rules = update_episode_num.load_rules(rules_file)
+    assert rules.strategies_for("11.1 TV Camara") == ()
+    assert len(rules.strategies_for("50.1 Warner Channel")) == 2
+    assert rules.strategies_for("50.1 Warner Channel")[1] is date_strategy
+    assert len(rules.strategies_for("70.1 Series Plus")) == 1
+    assert rules.strategies_for("02.1 Record News") == (date_strategy,)
+    assert set(rules.by_channel) == {"11.1 TV Camara", "50.1 Warner Channel", "70.1 Series Plus", "02.1 Record News"}
+
+
+@pytest.mark.parametrize("line, message", [
+    ("*, weekly", "unknown episode-num strategy"),
+    ("*", "expected 'pattern, strategies"),
+    ("*, regex, S(\\d+)", "must have a season and an episode"),
+    ("*, date, garbage(", "only used by the 'regex' strategy"),
+    ("*, keep, S(\\d+)E(\\d+)", "only used by the 'regex' strategy"),
+])
+def test_load_rules_rejects_invalid_rules(tmp_path, line, message):
+    path = tmp_path / "rules.ini"
+    path.write_text(line + "\n")
+    with pytest.raises(RuntimeError, match=message):
+        update_episode_num.load_rules(str(path))
+
+
+def test_channels_without_rule_use_date():
+    document, programme = programme_element("<title>News</title>")
+    update_episode_num.update_programme(EpisodeNumRules([]), programme, document)
+    assert programme.toxml().endswith('<episode-num system="onscreen">2024.0115</episode-num></programme>')
+
+
+def test_regex_strategy_falls_back_to_next_strategy(rules_file):
+    rules = update_episode_num.load_rules(rules_file)
+    document, programme = programme_element(
+        "<title>Show</title><sub-title>Piloto</sub-title><desc>T2 Ep 5 - Estreia</desc>", channel="50.1 Warner")
+    update_episode_num.update_programme(rules, programme, document)
+    assert '<episode-num system="onscreen">S02E05</episode-num>' in programme.toxml()
+
+    document, programme = programme_element("<title>Show</title><desc>No episode</desc>", channel="50.1 Warner")
+    update_episode_num.update_programme(rules, programme, document)
+    assert '<episode-num system="onscreen">2024.0115</episode-num>' in programme.toxml()
+
+
+def test_regex_strategy_ignores_matches_without_season_or_episode(tmp_path):
+    path = tmp_path / "rules.ini"
+    path.write_text("*, regex|date, (?:T(?P<season>\\d+))?\\s*Ep?(?P<episode>\\d+)\n")
+    rules = update_episode_num.load_rules(str(path))
+    document, programme = programme_element("<title>Show</title><desc>Ep5</desc>")
+    update_episode_num.update_programme(rules, programme, document)
+    assert '<episode-num system="onscreen">2024.0115</episode-num>' in programme.toxml()
+
+
+def test_keep_leaves_programme_untouched(rules_file):
+    rules = update_episode_num.load_rules(rules_file)
+    document, programme = programme_element("<title>Session</title><episode-num>1</episode-num>",
+                                            channel="11.1 TV Camara")
+    before = programme.toxml()
+    update_episode_num.update_programme(rules, programme, document)
+    assert programme.toxml() == before
+
+
+def test_valid_episode_num_is_kept():
+    document, programme = programme_element('<title>Show</title><episode-num system="onscreen">S1E1</episode-num>')
+    before = programme.toxml()
+    update_episode_num.update_programme(EpisodeNumRules([]), programme, document)
+    assert programme.toxml() == before
+
+
+def test_has_episode_num_reads_cdata():
+    document, programme = programme_element("<title>Show</title><episode-num><![CDATA[S1E1]]></episode-num>")
+    assert update_episode_num.has_episode_num(programme)
+    before = programme.toxml()
+    update_episode_num.update_programme(EpisodeNumRules([]), programme, document)
+    assert programme.toxml() == before
+
+
+def test_malformed_episode_num_is_replaced_in_place():
+    document, programme = programme_element(
+        '<title>Show</title><episode-num system="x">1</episode-num><episode-num system="y"/>'
+        '<rating><value>L</value></rating>')
+    update_episode_num.update_programme(EpisodeNumRules([]), programme, document)
+    # Replaced where the first one was, before <rating> as the XMLTV DTD orders them
+    assert [child.tagName for child in programme.childNodes] == ["title", "episode-num", "rating"]
+    assert update_episode_num.node_text(programme.childNodes[1]) == "2024.0115"
@@ -0,0 +1,138 @@
+import pytest
+
+import validate_guide
+
+
+def write_guide(tmp_path, body, close=True):
+    path = tmp_path / "guide.xml"
+    path.write_text('<?xml version="1.0" encoding="utf-8"?>\n<tv>\n' + body + ("\n</tv>\n" if close else ""))
+    return str(path)
+
+
+def programme(start, stop, channel="a", children="<title>Show</title>"):
+    return f'<programme start="{start}" stop="{stop}" channel="{channel}">{children}</programme>'
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("20240101000000 +0000", 1704067200),
+    ("20240101000000 -0300", 1704067200 + 3 * 3600),
+    ("202401010000 +0100", 1704067200 - 3600),
+    ("20240101", 1704067200),
+    ("20241301000000 +0000", None),
+    ("00000101000000 +0000", None),
+    ("20230231000000 +0000", None),
+    ("20240101250000 +0000", None),
+    ("20240101000000 0300", None),
+    ("2024", None),
+    ("bogus", None),
+])
+def test_parse_time(value, expected):
+    assert validate_guide.parse_time(value) == expected
+
+
+def test_validate_reports_interval_issues(tmp_path):
+    guide = write_guide(tmp_path, "\n".join([
+        '<channel id="a"/>',
+        programme("20240101000000 +0000", "20240101010000 +0000"),
+        programme("20240101005000 +0000", "20240101020000 +0000"),
+        programme("20240101030000 +0000", "20240101040000 +0000"),
+        programme("20240101020000 +0000", "20240101023000 +0000"),
+        programme("20240101040000 +0000", "20240101033000 +0000"),
+    ]))
+    report = validate_guide.validate(guide)
+    counts = report["counts"]
+    assert (counts["overlap"], counts["gap"], counts["unsorted"], counts["stop_before_start"]) == (1, 1, 1, 1)
+    assert report["issues"][0] == {
+        "type": "overlap", "channel": "a", "start": "20240101005000 +0000", "overlap_seconds": 600,
+    }
+    assert report["programmes"] == 5
+
+
+def test_validate_reports_invalid_times_instead_of_raising(tmp_path):
+    guide = write_guide(tmp_path, "\n".join([
+        '<channel id="a"/>',
+        '<channel id="b"/>',
+        programme("20241301000000 +0000", "20241301010000 +0000"),
+        programme("20230231000000 +0000", "20230231010000 +0000", channel="b"),
+    ]))
+    report = validate_guide.validate(guide)
+    assert report["counts"]["invalid_time"] == 2
+    # Channels whose programmes all have invalid times still have programmes
+    assert report["counts"]["channel_without_programmes"] == 0
+
+
+def test_validate_cross_references_channels(tmp_path):
+    guide = write_guide(tmp_path, "\n".join([
+        '<channel id="a"/>',
+        '<channel id="empty"/>',
+        programme("20240101000000 +0000", "20240101010000 +0000"),
+        programme("20240101000000 +0000", "20240101010000 +0000", channel="ghost"),
+        programme("20240101010000 +0000", "20240101020000 +0000", channel="ghost"),
+        '<channel id="late"/>',
+        programme("20240101000000 +0000", "20240101010000 +0000", channel="late"),
+    ]))
+    report = validate_guide.validate(guide)
+    assert report["counts"]["missing_channel"] == 2
+    assert report["counts"]["channel_without_programmes"] == 1
+    assert {"type": "missing_channel", "channel": "ghost", "programmes": 2} in report["issues"]
+    assert {"type": "channel_without_programmes", "channel": "empty"} in report["issues"]
+    assert report["truncated"] is False
+
+
+@pytest.mark.parametrize("episode_num, malformed", [
+    ('<episode-num system="onscreen">S1E1</episode-num>', False),
+    ('<episode-num system="onscreen"> s1 </episode-num>', False),
+    ('<episode-num system="onscreen">S1&amp;E</episode-num>', False),
+    ('<episode-num system="onscreen">1</episode-num>', True),
+    ('<episode-num system="onscreen"/>', True),
+    ('<episode-num system="x">1</episode-num><episode-num system="y">S1E1</episode-num>', True),
+    ("", False),
+])
+def test_validate_uses_has_episode_num_rule(tmp_path, episode_num, malformed):
+    guide = write_guide(tmp_path, '<channel id="a"/>\n' + programme(
+        "20240101000000 +0000", "20240101010000 +0000", children=f"<title>Show</title>{episode_num}"))
+    assert validate_guide.validate(guide)["counts"]["malformed_episode_num"] == int(malformed)
+
+
+def test_validate_truncates_issues(tmp_path):
+    guide = write_guide(tmp_path, "\n".join(
+        [programme("20240101000000 +0000", "20240101010000 +0000", channel=f"ghost{i}") for i in range(3)]))
+    report = validate_guide.validate(guide, max_issues=2)
+    assert report["counts"]["missing_channel"] == 3
+    assert len(report["issues"]) == 2
+    assert report["truncated"] is True
+
+
+def test_validate_keeps_failing_issues_when_truncated(tmp_path):
+    guide = write_guide(tmp_path, "\n".join(
+        ['<channel id="a"/>']
+        + [programme(f"202401010{i}0000 +0000", f"202401010{i}3000 +0000") for i in range(4)]
+        + [programme("20240101000000 +0000", "20240101010000 +0000", channel="ghost")]))
+    report = validate_guide.validate(guide, max_issues=2)
+    assert report["counts"]["gap"] == 3
+    assert [issue["type"] for issue in report["issues"]] == ["missing_channel", "gap"]
+    assert report["truncated"] is True
+
+    report = validate_guide.validate(guide, max_issues=2, fail_on=("gap",))
+    assert [issue["type"] for issue in report["issues"]] == ["gap", "gap"]
+
+
+def test_validate_reports_parse_errors(tmp_path):
+    guide = write_guide(tmp_path, '<channel id="a"/>\n' + programme("20240101000000 +0000", "20240101010000 +0000")
+                        + '\n<programme start="2024', close=False)
+    report = validate_guide.validate(guide)
+    assert report["programmes"] == 1
+    assert report["counts"]["parse_error"] == 1
+    assert report["issues"][0]["type"] == "parse_error"
+    assert report["issues"][0]["line"] == 5
+
+
+def test_main_writes_report_for_malformed_guide(tmp_path, monkeypatch):
+    guide = write_guide(tmp_path, '<channel id="a">', close=False)
+    report_path = tmp_path / "report.json"
+    monkeypatch.setattr("sys.argv", ["validate_guide.py", "--guide", guide, "--report", str(report_path),
+                                     "--fail-on", "overlap"])
+    with pytest.raises(SystemExit) as exit_info:
+        validate_guide.main()
+    assert exit_info.value.code == 1
+    assert '"valid": false' in report_path.read_text()
@@ -1,13 +1,23 @@
 import argparse
+import fnmatch
+import re
 import xml
 from xml.dom.minidom import parse
 
+# Strategy used for channels without a matching rule
+DEFAULT_STRATEGY = "date"
+# Default regex for the 'regex' strategy, matching 'S01E02', 's1 e2', etc
+DEFAULT_EPISODE_REGEX = r"[Ss](?P<season>\d{1,3})\s*[Ee](?P<episode>\d{1,4})"
+# Children searched by the 'regex' strategy, in order
+REGEX_TAGS = ("sub-title", "desc")
+
 
 def add_episode_num(
     system: str,
     content: str,
     programme: xml.dom.minidom.Element,
     document: xml.dom.minidom.Document,
+    episode_nums: list = None,
 ):
     """Add an episode-num tag to a programme element
 
@@ -16,34 +26,256 @@ def add_episode_num(
         content (str): The content of the episode number
         programme (xml.dom.minidom.Element): The programme to add the episode number to
         document (xml.dom.minidom.Document): The document that the programme is in
+        episode_nums (list): Existing episode-num children, as returned by scan_programme.
+            They are looked up when not specified
     """
-    if has_episode_num(programme, strict=False):  # iDelete malformed episode_num first
-        episode_nums = programme.getElementsByTagName("episode-num")
-        for ep in episode_nums:
-            programme.removeChild(ep)
+    if episode_nums is None:
+        episode_nums = scan_programme(programme)[0]
     episode_num = document.createElement("episode-num")
     episode_num.setAttribute("system", system)
     episode_num_text = document.createTextNode(content)
     episode_num.appendChild(episode_num_text)
-    programme.appendChild(episode_num)
+    if episode_nums:  # Replace malformed episode_num in place instead of deleting it first
+        programme.replaceChild(episode_num, episode_nums[0])
+        for ep in episode_nums[1:]:
+            programme.removeChild(ep)
+    else:
+        programme.appendChild(episode_num)
 
 
-def has_episode_num(programme: xml.dom.minidom.Element, strict: bool=True):
+def has_episode_num(programme: xml.dom.minidom.Element, strict: bool=True, episode_nums: list = None):
     """Check if a programme has an episode number
 
     Args:
         programme (xml.dom.minidom.Element): The programme to check
+        strict (bool): Whether episode numbers too short to be valid are considered missing
+        episode_nums (list): Existing episode-num children, as returned by scan_programme.
+            They are looked up when not specified
 
     Returns:
         bool: True if the programme has an episode number, False otherwise
     """
-    title = programme.getElementsByTagName("title")
-    episode_num = programme.getElementsByTagName("episode-num")
-    if len(episode_num) > 0 and (not strict or len(episode_num[0].firstChild.nodeValue) >= 4):  # Assuming 's1e1' is the shortest length
+    if episode_nums is None:
+        episode_nums = scan_programme(programme)[0]
+    if len(episode_nums) > 0 and (not strict or is_valid_episode_num(node_text(episode_nums[0]))):
         return True
     return False
 
 
+def is_valid_episode_num(content: str):
+    """Check if the content of an episode-num is long enough to be an episode number
+
+    Args:
+        content (str): The text of the episode-num
+
+    Returns:
+        bool: True if the episode number is valid, False otherwise
+    """
+    return len(content) >= 4  # Assuming 's1e1' is the shortest length
+
+
+def node_text(node: xml.dom.minidom.Element):
+    """Concatenate the text of an element
+
+    Args:
+        node (xml.dom.minidom.Element): The element to read the text from
+
+    Returns:
+        str: The text of the element, empty if it has none
+    """
+    return "".join(
+        child.data for child in node.childNodes if child.nodeType in (child.TEXT_NODE, child.CDATA_SECTION_NODE)
+    )
+
+
+def scan_programme(programme: xml.dom.minidom.Element):
+    """Collect the children of a programme used by the rules in a single pass
+
+    Args:
+        programme (xml.dom.minidom.Element): The programme to scan
+
+    Returns:
+        tuple: The list of episode-num children and a dict mapping the tags at REGEX_TAGS to their first child
+    """
+    episode_nums = []
+    children = {}
+    for child in programme.childNodes:
+        if child.nodeType != child.ELEMENT_NODE:
+            continue
+        if child.tagName == "episode-num":
+            episode_nums.append(child)
+        elif child.tagName in REGEX_TAGS and child.tagName not in children:
+            children[child.tagName] = child
+    return episode_nums, children
+
+
+def date_strategy(programme: xml.dom.minidom.Element, children: dict):
+    """Synthesize an episode number from the start date of a programme
+
+    Args:
+        programme (xml.dom.minidom.Element): The programme to synthesize the episode number for
+        children (dict): The children of the programme at REGEX_TAGS, as returned by scan_programme
+
+    Returns:
+        tuple: The system and content of the episode number
+    """
+    # The season is the first 4 digits of the start time (YYYY) and the episode is the next 4 (MMDD) separated by a dot
+    start = programme.getAttribute("start")
+    return "onscreen", start[:4] + "." + start[4:8]
+
+
+def regex_strategy(pattern: str = DEFAULT_EPISODE_REGEX):
+    """Create a strategy extracting the season and episode from the children at REGEX_TAGS
+
+    A match whose season or episode group did not participate (e.g. an optional group) is not an episode number.
+
+    Args:
+        pattern (str): Regex with 'season' and 'episode' named groups (or the first two groups otherwise)
+
+    Returns:
+        callable: The strategy
+    """
+    regex = re.compile(pattern)
+    if regex.groups < 2:
+        raise RuntimeError(f"regex '{pattern}' must have a season and an episode groups")
+    season_group, episode_group = (
+        ("season", "episode") if {"season", "episode"} <= set(regex.groupindex) else (1, 2)
+    )
+
+    def strategy(programme: xml.dom.minidom.Element, children: dict):
+        for tag in REGEX_TAGS:
+            if tag in children:
+                match = regex.search(node_text(children[tag]))
+                if match:
+                    season, episode = match.group(season_group, episode_group)
+                    if season is not None and episode is not None:
+                        return "onscreen", f"S{int(season):02d}E{int(episode):02d}"
+        return None
+
+    return strategy
+
+
+class EpisodeNumRules:
+    """Channel id patterns mapped to the strategies used to synthesize episode numbers
+
+    Rules are tried in order and the first one whose pattern matches the channel id is used.
+    The rule of each channel is resolved once and cached, so the cost per programme does not
+    depend on the number of rules.
+
+    Args:
+        rules (list): (pattern, strategies, regex) tuples. Patterns use shell-style wildcards and strategies
+            are 'date', 'regex' or 'keep' separated by '|', tried in order until one of them synthesizes
+            an episode number. 'keep' leaves the programme as is.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = [
+            (re.compile(fnmatch.translate(pattern)), self.compile_strategies(strategies, regex))
+            for pattern, strategies, regex in rules
+        ]
+        self.default = self.compile_strategies(DEFAULT_STRATEGY, None)
+        self.by_channel = {}
+
+    @staticmethod
+    def compile_strategies(strategies: str, regex: str):
+        """Compile the strategies of a rule
+
+        Args:
+            strategies (str): Strategy names separated by '|'
+            regex (str): Regex for the 'regex' strategy or None to use DEFAULT_EPISODE_REGEX
+
+        Returns:
+            tuple: The strategies, stopping at 'keep'
+        """
+        compiled = []
+        uses_regex = False
+        for name in strategies.split("|"):
+            name = name.strip()
+            if name == "keep":
+                break
+            elif name == "date":
+                compiled.append(date_strategy)
+            elif name == "regex":
+                compiled.append(regex_strategy(regex or DEFAULT_EPISODE_REGEX))
+                uses_regex = True
+            else:
+                raise RuntimeError(f"unknown episode-num strategy '{name}'")
+        if regex and not uses_regex:
+            raise RuntimeError(f"regex '{regex}' is only used by the 'regex' strategy, not by '{strategies}'")
+        return tuple(compiled)
+
+    def strategies_for(self, channel: str):
+        """Find the strategies for a channel
+
+        Args:
+            channel (str): The channel id
+
+        Returns:
+            tuple: The strategies, empty when the channel's programmes must be kept as is
+        """
+        strategies = self.by_channel.get(channel)
+        if strategies is None:
+            strategies = next(
+                (strategies for pattern, strategies in self.rules if pattern.match(channel)), self.default
+            )
+            self.by_channel[channel] = strategies
+        return strategies
+
+
+def load_rules(path: str):
+    """Read a rules file
+
+    Each line has a channel id pattern, the strategies and an optional regex for the 'regex' strategy,
+    separated by commas. Lines starting with # are comments.
+
+    Args:
+        path (str): Path to the rules file
+
+    Returns:
+        EpisodeNumRules: The compiled rules
+    """
+    rules = []
+    with open(path, encoding="utf-8") as rules_file:
+        for line_number, line in enumerate(rules_file, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",", 2)]
+            if len(fields) < 2:
+                raise RuntimeError(f"{path}:{line_number}: expected 'pattern, strategies[, regex]'")
+            pattern, strategies = fields[0], fields[1]
+            regex = fields[2] if len(fields) > 2 else None
+            rules.append((pattern, strategies, regex))
+    return EpisodeNumRules(rules)
+
+
+def update_programme(
+    rules: EpisodeNumRules,
+    programme: xml.dom.minidom.Element,
+    document: xml.dom.minidom.Document,
+):
+    """Add an episode-num tag to a programme without a valid one, using the strategies of its channel
+
+    Args:
+        rules (EpisodeNumRules): The rules for each channel
+        programme (xml.dom.minidom.Element): The programme to update
+        document (xml.dom.minidom.Document): The document that the programme is in
+    """
+    strategies = rules.strategies_for(programme.getAttribute("channel"))
+    if not strategies:
+        return
+    episode_nums, children = scan_programme(programme)
+    # Check if it already has an episode number
+    if has_episode_num(programme, strict=True, episode_nums=episode_nums):
+        # If it does, skip it
+        return
+    for strategy in strategies:
+        episode_num = strategy(programme, children)
+        if episode_num is not None:
+            add_episode_num(*episode_num, programme, document, episode_nums=episode_nums)
+            return
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--guide", help="Path to XMLTV Guide file", required=True)
@@ -52,8 +284,13 @@ def main():
         help="Path to updated XMLTV Guide file that ill be created",
         required=True,
     )
+    parser.add_argument(
+        "--rules",
+        help=f"Path to the episode-num rules file. All channels use '{DEFAULT_STRATEGY}' when not specified",
+    )
 
     args = parser.parse_args()
+    rules = load_rules(args.rules) if args.rules else EpisodeNumRules([])
 
     with open(args.save_to, "w") as f:
         # Parse XML from a filename
@@ -62,13 +299,7 @@ def main():
         # We want to add an episode-num tag to each programme
         programme = document.getElementsByTagName("programme")
         for p in programme:
-            # Check if it already has an episode number
-            if has_episode_num(p, strict=True):
-                # If it does, skip it
-                continue
-            # The season is the first 4 digits of the start time (YYYY) and the episode is the next 4 (MMDD) separated by a dot
-            onscreen = p.getAttribute("start")[:4] + "." + p.getAttribute("start")[4:8]
-            add_episode_num("onscreen", onscreen, p, document)
+            update_programme(rules, p, document)
         # Write the updated XML to a file
         document.writexml(f)
 
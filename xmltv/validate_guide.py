@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import functools
+import json
+import sys
+from xml.parsers import expat
+
+from update_episode_num import is_valid_episode_num
+
+# Issues reported by the validator. The ones at ERRORS make the guide invalid by default
+ERRORS = ("parse_error", "overlap", "stop_before_start", "unsorted", "invalid_time", "missing_channel")
+WARNINGS = ("gap", "malformed_episode_num", "channel_without_programmes")
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def parse_time(value: str):
+    """Parse an XMLTV date such as '20231201093000 -0300' into seconds since the epoch
+
+    Args:
+        value (str): XMLTV date. Seconds, minutes and hours may be omitted and the offset defaults to UTC
+
+    Returns:
+        int: Seconds since the epoch or None when the date is malformed
+    """
+    digits, _, offset = value.strip().partition(" ")
+    if len(digits) < 8 or not digits.isdigit():
+        return None
+    digits = digits.ljust(14, "0")
+    try:
+        seconds = int(
+            datetime.datetime(
+                int(digits[0:4]),
+                int(digits[4:6]),
+                int(digits[6:8]),
+                int(digits[8:10]),
+                int(digits[10:12]),
+                int(digits[12:14]),
+                tzinfo=datetime.timezone.utc,
+            ).timestamp()
+        )
+    except ValueError:
+        return None
+    if offset:
+        if len(offset) != 5 or offset[0] not in "+-" or not offset[1:].isdigit():
+            return None
+        shift = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        seconds += -shift if offset[0] == "+" else shift
+    return seconds
+
+
+class GuideValidator:
+    """Validate XMLTV programmes incrementally, keeping only the last interval of each channel
+
+    Args:
+        max_issues (int): Maximum number of issues kept with details. All issues are counted regardless
+        fail_on (tuple): Issues that make the guide invalid. They are listed before the others, so the details
+            of why the guide is invalid are kept when there are more than max_issues
+    """
+
+    def __init__(self, max_issues: int = 100, fail_on: tuple = ERRORS):
+        self.max_issues = max_issues
+        self.fail_on = set(fail_on) | {"parse_error"}
+        self.channel_ids = set()
+        # channel ids referenced by programmes, even when their times are invalid
+        self.programme_channels = set()
+        self.programmes = 0
+        # channel id -> (start, stop) of the last programme seen for that channel
+        self.last_interval = {}
+        # channel id -> number of programmes referencing a channel not declared (yet)
+        self.undeclared = {}
+        self.counts = {issue: 0 for issue in ERRORS + WARNINGS}
+        # Details of the failing issues and of the other ones, each list kept up to max_issues
+        self.failing_issues = []
+        self.other_issues = []
+        self.truncated = False
+
+    def report_issue(self, issue: str, count: int = 1, **details):
+        self.counts[issue] += count
+        issues = self.failing_issues if issue in self.fail_on else self.other_issues
+        if len(issues) < self.max_issues:
+            issues.append({"type": issue, **details})
+        else:
+            self.truncated = True
+
+    def add_channel(self, attributes: dict):
+        self.channel_ids.add(attributes.get("id", "").strip())
+
+    def add_programme(self, attributes: dict, episode_num: str = None):
+        """Validate a programme against the previous programme of the same channel
+
+        Args:
+            attributes (dict): Attributes of the programme element
+            episode_num (str): Text of the first episode-num child or None when there is none
+        """
+        self.programmes += 1
+        channel = attributes.get("channel", "").strip()
+        self.programme_channels.add(channel)
+        if channel not in self.channel_ids:
+            self.undeclared[channel] = self.undeclared.get(channel, 0) + 1
+
+        start_text = attributes.get("start", "")
+        stop_text = attributes.get("stop")
+        start = parse_time(start_text)
+        stop = parse_time(stop_text) if stop_text is not None else None
+        if start is None or (stop_text is not None and stop is None):
+            self.report_issue("invalid_time", channel=channel, start=start_text, stop=stop_text)
+        else:
+            self._check_interval(channel, start, stop, start_text, stop_text)
+
+        if episode_num is not None and not is_valid_episode_num(episode_num):
+            self.report_issue("malformed_episode_num", channel=channel, start=start_text, episode_num=episode_num)
+
+    def _check_interval(self, channel, start, stop, start_text, stop_text):
+        if stop is not None and stop < start:
+            self.report_issue("stop_before_start", channel=channel, start=start_text, stop=stop_text)
+            stop = start
+
+        last = self.last_interval.get(channel)
+        if last is not None:
+            last_start, last_stop = last
+            if start < last_start:
+                # Programmes must be sorted by start time, so the last interval is enough to find overlaps
+                self.report_issue("unsorted", channel=channel, start=start_text)
+                return
+            if last_stop is not None:
+                if start < last_stop:
+                    self.report_issue(
+                        "overlap", channel=channel, start=start_text, overlap_seconds=last_stop - start
+                    )
+                elif start > last_stop:
+                    self.report_issue("gap", channel=channel, start=start_text, gap_seconds=start - last_stop)
+        self.last_interval[channel] = (start, stop)
+
+    def finish(self):
+        """Cross-reference programme channels against the declared channels
+
+        Returns:
+            dict: Machine readable report
+        """
+        for channel, programmes in self.undeclared.items():
+            if channel not in self.channel_ids:
+                # Counted per programme, listed once per channel
+                self.report_issue("missing_channel", count=programmes, channel=channel, programmes=programmes)
+        for channel in sorted(self.channel_ids.difference(self.programme_channels)):
+            self.report_issue("channel_without_programmes", channel=channel)
+
+        issues = self.failing_issues + self.other_issues
+        return {
+            "channels": len(self.channel_ids),
+            "programmes": self.programmes,
+            "counts": self.counts,
+            "issues": issues[: self.max_issues],
+            "truncated": self.truncated or len(issues) > self.max_issues,
+        }
+
+
+def validate(guide, max_issues: int = 100, fail_on: tuple = ERRORS):
+    """Validate an XMLTV guide in a single streaming pass
+
+    Only the attributes of the current programme and the text of its first episode-num are kept in memory,
+    so memory is bounded by the number of channels instead of the number of programmes.
+
+    Args:
+        guide (str): Path to XMLTV Guide file
+        max_issues (int): Maximum number of issues kept with details
+        fail_on (tuple): Issues that make the guide invalid, listed first
+
+    Returns:
+        dict: Machine readable report
+    """
+    validator = GuideValidator(max_issues, fail_on)
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    # Attributes and first episode-num text of the programme being parsed. Character data is only
+    # collected inside that episode-num: setting a handler flushes the buffered text to the previous one
+    programme = None
+    episode_num = None
+    episode_num_text = []
+    collecting = False
+
+    def start_element(name, attributes):
+        nonlocal programme, collecting
+        if name == "programme":
+            programme = attributes
+        elif name == "episode-num":
+            if programme is not None and episode_num is None:
+                collecting = True
+                parser.CharacterDataHandler = episode_num_text.append
+        elif name == "channel":
+            validator.add_channel(attributes)
+
+    def end_element(name):
+        nonlocal programme, episode_num, collecting
+        if name == "programme":
+            validator.add_programme(programme, episode_num)
+            programme = episode_num = None
+        elif name == "episode-num" and collecting:
+            collecting = False
+            parser.CharacterDataHandler = None
+            episode_num = "".join(episode_num_text)
+            episode_num_text.clear()
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    with open(guide, "rb") as f:
+        try:
+            parser.ParseFile(f)
+        except expat.ExpatError as e:
+            # e.g. a truncated grab. Everything parsed so far is still reported
+            validator.report_issue(
+                "parse_error", line=e.lineno, column=e.offset, message=expat.errors.messages[e.code]
+            )
+    return validator.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Validate an XMLTV guide for overlapping programmes, gaps, bad times, missing channels and malformed episode-num"
+    )
+    parser.add_argument("--guide", help="Path to XMLTV Guide file", required=True)
+    parser.add_argument("--report", help="Path to the JSON report. Defaults to the standard output")
+    parser.add_argument(
+        "--max-issues", help="Maximum number of issues listed in the report", type=int, default=100
+    )
+    parser.add_argument(
+        "--fail-on",
+        help=f"Comma separated issues that make the guide invalid (default: {','.join(ERRORS)}). "
+        "A guide with parse_error is never valid",
+        default=",".join(ERRORS),
+    )
+    args = parser.parse_args()
+
+    fail_on = [issue.strip() for issue in args.fail_on.split(",") if issue.strip()]
+    unknown = [issue for issue in fail_on if issue not in ERRORS + WARNINGS]
+    if unknown:
+        parser.error(f"unknown issues for --fail-on: {unknown}")
+
+    report = validate(args.guide, args.max_issues, fail_on)
+    report["guide"] = args.guide
+    report["valid"] = not report["counts"]["parse_error"] and not any(report["counts"][issue] for issue in fail_on)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    sys.exit(0 if report["valid"] else 1)
+
+
+if __name__ == "__main__":
+    main()